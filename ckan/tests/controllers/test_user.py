@@ -2,45 +2,114 @@
 import mock
 import pytest
 from bs4 import BeautifulSoup
+from six.moves.urllib.parse import urlparse
+from sqlalchemy import text
 
 import ckan.tests.factories as factories
 import ckan.tests.helpers as helpers
 from ckan import model
+from ckan.common import config
 from ckan.lib.helpers import url_for
-from ckan.lib.mailer import create_reset_key, MailerException
+from ckan.lib.mailer import MailerException
 
 
 webtest_submit = helpers.webtest_submit
 submit_and_follow = helpers.submit_and_follow
+cached_url_for = helpers.cached_url_for
+
+# The action of the login form, handled by repoze.who
+LOGIN_URL = "/login_generic"
+
+# The flash message shown after a password reset is requested, whether
+# the user exists or not
+RESET_EMAILED_MSG = "A reset link has been emailed to you"
+
+
+_DELETE_ACTIVITIES = text("DELETE FROM activity_detail; DELETE FROM activity")
+
+
+# This is the exception when the mailer is not configured
+_SMTP_REFUSED = MailerException(
+    'SMTP server could not be connected to: "localhost" '
+    "[Errno 111] Connection refused"
+)
 
 
 def _clear_activities():
-    model.Session.query(model.ActivityDetail).delete()
-    model.Session.query(model.Activity).delete()
-    model.Session.flush()
+    model.Session.execute(_DELETE_ACTIVITIES)
+
+
+def _env(user):
+    # WSGI environ values are native strings on both Python 2 and 3
+    return {"REMOTE_USER": str(user["name"])}
+
+
+def _flash_messages(response):
+    # The messages that the page we are redirected to would show, read
+    # from the session instead of following the redirect. Validation
+    # errors are flashed as dicts, so format every message as text.
+    session = response.request.environ["beaker.session"]
+    return u" ".join(
+        u"{}".format(message) for _, message, _ in session.get("flash", [])
+    )
 
 
 def _get_user_edit_page(app):
     user = factories.User()
-    env = {"REMOTE_USER": user["name"].encode("ascii")}
-    response = app.get(url=url_for("user.edit"), extra_environ=env)
+    env = _env(user)
+    response = app.get(url=cached_url_for("user.edit"), extra_environ=env)
     return env, response, user
 
 
-@pytest.mark.usefixtures("clean_db")
+@pytest.fixture(scope="class")
+def shared_user(clean_db_once):
+    # Created outside of the per-test transaction and shared by all the
+    # tests that request it, so they must not change it.
+    return factories.User()
+
+
+@pytest.fixture(scope="class")
+def activity_user(clean_db_once):
+    return factories.User()
+
+
+@pytest.fixture(scope="class")
+def activity_dataset(activity_user):
+    # Changes made by the tests are rolled back by ``rollback_db``, but
+    # tests should still work on a copy of the dict.
+    return factories.Dataset(user=activity_user)
+
+
+@pytest.fixture(scope="class")
+def activity_group(activity_user):
+    return factories.Group(user=activity_user)
+
+
+@pytest.fixture
+def send_reset_link(monkeypatch):
+    send_reset_link = mock.MagicMock()
+    monkeypatch.setattr("ckan.lib.mailer.send_reset_link", send_reset_link)
+    return send_reset_link
+
+
+@pytest.mark.usefixtures("fast_password_hashing", "rollback_db")
 class TestUser(object):
     def test_register_a_user(self, app):
-        response = app.get(url=url_for("user.register"))
-
-        form = response.forms["user-register-form"]
-        form["name"] = "newuser"
-        form["fullname"] = "New User"
-        form["email"] = "test@test.com"
-        form["password1"] = "TestPassword1"
-        form["password2"] = "TestPassword1"
-        response = submit_and_follow(app, form, name="save")
-        response = response.follow()
-        assert 200 == response.status_int
+        # The registration form is plain, so post to it directly instead
+        # of rendering it first.
+        params = {
+            "name": "newuser",
+            "fullname": "New User",
+            "email": "test@test.com",
+            "password1": "TestPassword1",
+            "password2": "TestPassword1",
+            "save": "",
+        }
+        response = app.post(
+            url=cached_url_for("user.register"), params=params, status=302
+        )
+        # the new user is logged in and sent to their own page
+        assert urlparse(response.location).path == cached_url_for("user.me")
 
         user = helpers.call_action("user_show", id="newuser")
         assert user["name"] == "newuser"
@@ -48,36 +117,29 @@ class TestUser(object):
         assert not (user["sysadmin"])
 
     def test_register_user_bad_password(self, app):
-        response = app.get(url=url_for("user.register"))
-
-        form = response.forms["user-register-form"]
-        form["name"] = "newuser"
-        form["fullname"] = "New User"
-        form["email"] = "test@test.com"
-        form["password1"] = "TestPassword1"
-        form["password2"] = ""
-
-        response = form.submit("save")
+        params = {
+            "name": "newuser",
+            "fullname": "New User",
+            "email": "test@test.com",
+            "password1": "TestPassword1",
+            "password2": "",
+            "save": "",
+        }
+        response = app.post(
+            url=cached_url_for("user.register"), params=params, status=200
+        )
         assert "The passwords you entered do not match" in response
 
     def test_create_user_as_sysadmin(self, app):
-        admin_pass = "RandomPassword123"
-        sysadmin = factories.Sysadmin(password=admin_pass)
-
-        # Have to do an actual login as this test relies on repoze
-        #  cookie handling.
-
-        # get the form
-        response = app.get("/user/login")
-        # ...it's the second one
-        login_form = response.forms[1]
-        # fill it in
-        login_form["login"] = sysadmin["name"]
-        login_form["password"] = admin_pass
-        # submit it
-        login_form.submit("save")
-
-        response = app.get(url=url_for("user.register"))
+        # This is the one test that does an actual login, as it relies on
+        # repoze cookie handling. Other tests just set REMOTE_USER.
+        password = "RandomPassword123"
+        sysadmin = factories.Sysadmin(password=password)
+        app.post(
+            LOGIN_URL, params={"login": sysadmin["name"], "password": password}
+        )
+
+        response = app.get(url=cached_url_for("user.register"))
         assert "user-register-form" in response.forms
         form = response.forms["user-register-form"]
         form["name"] = "newestuser"
@@ -97,27 +159,22 @@ class TestUser(object):
         # make a user
         user = factories.User()
 
-        # get the form
-        response = app.get("/user/login")
-        # ...it's the second one
-        login_form = response.forms[1]
-
-        # fill it in
-        login_form["login"] = user["name"]
-        login_form["password"] = "RandomPassword123"
-
-        # submit it
-        submit_response = login_form.submit()
+        # submit the login details
+        submit_response = app.post(
+            LOGIN_URL,
+            params={"login": user["name"], "password": "RandomPassword123"},
+        )
         # let's go to the last redirect in the chain
         final_response = helpers.webtest_maybe_follow(submit_response)
 
+        body = final_response.text
         # the response is the user dashboard, right?
-        final_response.mustcontain(
-            '<a href="/dashboard/">Dashboard</a>',
-            '<span class="username">{0}</span>'.format(user["fullname"]),
-        )
+        assert '<a href="/dashboard/">Dashboard</a>' in body
+        assert '<span class="username">{0}</span>'.format(
+            user["fullname"]
+        ) in body
         # and we're definitely not back on the login page.
-        final_response.mustcontain(no='<h1 class="page-heading">Login</h1>')
+        assert '<h1 class="page-heading">Login</h1>' not in body
 
     def test_registered_user_login_bad_password(self, app):
         """
@@ -128,30 +185,22 @@ class TestUser(object):
         # make a user
         user = factories.User()
 
-        # get the form
-        response = app.get("/user/login")
-        # ...it's the second one
-        login_form = response.forms[1]
-
-        # fill it in
-        login_form["login"] = user["name"]
-        login_form["password"] = "BadPass1"
-
-        # submit it
-        submit_response = login_form.submit()
+        # submit the login details
+        submit_response = app.post(
+            LOGIN_URL, params={"login": user["name"], "password": "BadPass1"}
+        )
         # let's go to the last redirect in the chain
         final_response = helpers.webtest_maybe_follow(submit_response)
 
+        body = final_response.text
         # the response is the login page again
-        final_response.mustcontain(
-            '<h1 class="page-heading">Login</h1>',
-            "Login failed. Bad username or password.",
-        )
+        assert '<h1 class="page-heading">Login</h1>' in body
+        assert "Login failed. Bad username or password." in body
         # and we're definitely not on the dashboard.
-        final_response.mustcontain(no='<a href="/dashboard">Dashboard</a>'),
-        final_response.mustcontain(
-            no='<span class="username">{0}</span>'.format(user["fullname"])
-        )
+        assert '<a href="/dashboard">Dashboard</a>' not in body
+        assert '<span class="username">{0}</span>'.format(
+            user["fullname"]
+        ) not in body
 
     def test_user_logout_url_redirect(self, app):
         """_logout url redirects to logged out page.
@@ -160,7 +209,7 @@ class TestUser(object):
     the associated redirect.
     """
 
-        logout_url = url_for("user.logout")
+        logout_url = cached_url_for("user.logout")
         logout_response = app.get(logout_url, status=302)
         final_response = helpers.webtest_maybe_follow(logout_response)
 
@@ -176,17 +225,18 @@ class TestUser(object):
     the associated redirect.
     """
 
-        logout_url = url_for("user.logout")
+        logout_url = cached_url_for("user.logout")
         # Remove the prefix otherwise the test app won't find the correct route
         logout_url = logout_url.replace("/my/prefix", "")
         logout_response = app.get(logout_url, status=302)
         assert logout_response.status_int == 302
         assert "/my/prefix/user/logout" in logout_response.location
 
-    def test_not_logged_in_dashboard(self, app):
-
-        for route in ["index", "organizations", "datasets", "groups"]:
-            app.get(url=url_for(u"dashboard.{}".format(route)), status=403)
+    @pytest.mark.parametrize(
+        "route", ["index", "organizations", "datasets", "groups"]
+    )
+    def test_not_logged_in_dashboard(self, app, route):
+        app.get(url=cached_url_for(u"dashboard.{}".format(route)), status=403)
 
     def test_own_datasets_show_up_on_user_dashboard(self, app):
         user = factories.User()
@@ -195,9 +245,9 @@ class TestUser(object):
             user=user, name="my-own-dataset", title=dataset_title
         )
 
-        env = {"REMOTE_USER": user["name"].encode("ascii")}
+        env = _env(user)
         response = app.get(
-            url=url_for("dashboard.datasets"), extra_environ=env
+            url=cached_url_for("dashboard.datasets"), extra_environ=env
         )
 
         assert dataset_title in response
@@ -210,16 +260,16 @@ class TestUser(object):
             user=user1, name="someone-elses-dataset", title=dataset_title
         )
 
-        env = {"REMOTE_USER": user2["name"].encode("ascii")}
+        env = _env(user2)
         response = app.get(
-            url=url_for("dashboard.datasets"), extra_environ=env
+            url=cached_url_for("dashboard.datasets"), extra_environ=env
         )
 
         assert not (dataset_title in response)
 
     def test_user_edit_no_user(self, app):
 
-        response = app.get(url_for("user.edit", id=None), status=400)
+        response = app.get(cached_url_for("user.edit", id=None), status=400)
         assert "No user specified" in response
 
     def test_user_edit_unknown_user(self, app):
@@ -227,7 +277,7 @@ class TestUser(object):
     page."""
 
         response = app.get(
-            url_for("user.edit", id="unknown_person"), status=403
+            cached_url_for("user.edit", id="unknown_person"), status=403
         )
 
     def test_user_edit_not_logged_in(self, app):
@@ -241,8 +291,8 @@ class TestUser(object):
     def test_edit_user(self, app):
         user = factories.User(password="TestPassword1")
 
-        env = {"REMOTE_USER": user["name"].encode("ascii")}
-        response = app.get(url=url_for("user.edit"), extra_environ=env)
+        env = _env(user)
+        response = app.get(url=cached_url_for("user.edit"), extra_environ=env)
         # existing values in the form
         form = response.forms["user-edit-form"]
         assert form["name"].value == user["name"]
@@ -301,82 +351,22 @@ class TestUser(object):
         response = submit_and_follow(app, form, env, "save")
         assert "Profile updated" in response
 
-    def test_edit_user_logged_in_username_change(self, app):
-
-        user_pass = "TestPassword1"
-        user = factories.User(password=user_pass)
-
-        # Have to do an actual login as this test relys on repoze cookie handling.
-        # get the form
-        response = app.get("/user/login")
-        # ...it's the second one
-        login_form = response.forms[1]
-        # fill it in
-        login_form["login"] = user["name"]
-        login_form["password"] = user_pass
-        # submit it
-        login_form.submit()
-
-        # Now the cookie is set, run the test
-        response = app.get(url=url_for("user.edit"))
-        # existing values in the form
-        form = response.forms["user-edit-form"]
-
-        # new values
-        form["name"] = "new-name"
-        env = {"REMOTE_USER": user["name"].encode("ascii")}
-        response = webtest_submit(form, "save", status=200, extra_environ=env)
-        assert "That login name can not be modified" in response
-
-    def test_edit_user_logged_in_username_change_by_name(self, app):
-        user_pass = "TestPassword1"
-        user = factories.User(password=user_pass)
-
-        # Have to do an actual login as this test relys on repoze cookie handling.
-        # get the form
-        response = app.get("/user/login")
-        # ...it's the second one
-        login_form = response.forms[1]
-        # fill it in
-        login_form["login"] = user["name"]
-        login_form["password"] = user_pass
-        # submit it
-        login_form.submit()
-
-        # Now the cookie is set, run the test
-        response = app.get(url=url_for("user.edit", id=user["name"]))
-        # existing values in the form
-        form = response.forms["user-edit-form"]
-
-        # new values
-        form["name"] = "new-name"
-        env = {"REMOTE_USER": user["name"].encode("ascii")}
-        response = webtest_submit(form, "save", status=200, extra_environ=env)
-        assert "That login name can not be modified" in response
+    @pytest.mark.parametrize("id_field", [None, "name", "id"])
+    def test_edit_user_logged_in_username_change(
+        self, app, shared_user, id_field
+    ):
+        user = shared_user
+        url_params = {"id": user[id_field]} if id_field else {}
 
-    def test_edit_user_logged_in_username_change_by_id(self, app):
-        user_pass = "TestPassword1"
-        user = factories.User(password=user_pass)
-
-        # Have to do an actual login as this test relys on repoze cookie handling.
-        # get the form
-        response = app.get("/user/login")
-        # ...it's the second one
-        login_form = response.forms[1]
-        # fill it in
-        login_form["login"] = user["name"]
-        login_form["password"] = user_pass
-        # submit it
-        login_form.submit()
-
-        # Now the cookie is set, run the test
-        response = app.get(url=url_for("user.edit", id=user["id"]))
+        env = _env(user)
+        response = app.get(
+            url=cached_url_for("user.edit", **url_params), extra_environ=env
+        )
         # existing values in the form
         form = response.forms["user-edit-form"]
 
         # new values
         form["name"] = "new-name"
-        env = {"REMOTE_USER": user["name"].encode("ascii")}
         response = webtest_submit(form, "save", status=200, extra_environ=env)
         assert "That login name can not be modified" in response
 
@@ -385,8 +375,10 @@ class TestUser(object):
         params = {"password1": password, "password2": password}
         user = factories.User()
         user_obj = helpers.model.User.by_name(user["name"])
-        create_reset_key(user_obj)
-        key = user_obj.reset_key
+        # No need for a real key (or a commit), the request runs in the
+        # same session
+        key = user_obj.reset_key = u"0" * 32
+        model.Session.flush()
 
         offset = url_for(
             controller="user",
@@ -438,34 +430,39 @@ class TestUser(object):
         user_one = factories.User()
         user_two = factories.User()
 
-        env = {"REMOTE_USER": user_one["name"].encode("ascii")}
+        env = _env(user_one)
         follow_url = url_for(
             controller="user", action="follow", id=user_two["id"]
         )
         response = app.post(follow_url, extra_environ=env, status=302)
-        response = response.follow()
-        assert (
-            "You are now following {0}".format(user_two["display_name"])
-            in response
+        assert urlparse(response.location).path == url_for(
+            "user.read", id=user_two["id"]
         )
+        assert "You are now following {0}".format(
+            user_two["display_name"]
+        ) in _flash_messages(response)
 
     def test_user_follow_not_exist(self, app):
         """Pass an id for a user that doesn't exist"""
 
         user_one = factories.User()
 
-        env = {"REMOTE_USER": user_one["name"].encode("ascii")}
-        follow_url = url_for(controller="user", action="follow", id="not-here")
+        env = _env(user_one)
+        follow_url = cached_url_for(
+            controller="user", action="follow", id="not-here"
+        )
         response = app.post(follow_url, extra_environ=env, status=302)
-        response = response.follow(status=302)
-        assert "user/login" in response.headers["location"]
+        assert urlparse(response.location).path == url_for(
+            "user.read", id="not-here"
+        )
+        assert "Not found: User" in _flash_messages(response)
 
     def test_user_unfollow(self, app):
 
         user_one = factories.User()
         user_two = factories.User()
 
-        env = {"REMOTE_USER": user_one["name"].encode("ascii")}
+        env = _env(user_one)
         follow_url = url_for(
             controller="user", action="follow", id=user_two["id"]
         )
@@ -475,12 +472,12 @@ class TestUser(object):
         unfollow_response = app.post(
             unfollow_url, extra_environ=env, status=302
         )
-        unfollow_response = unfollow_response.follow()
-
-        assert (
-            "You are no longer following {0}".format(user_two["display_name"])
-            in unfollow_response
+        assert urlparse(unfollow_response.location).path == url_for(
+            "user.read", id=user_two["id"]
         )
+        assert "You are no longer following {0}".format(
+            user_two["display_name"]
+        ) in _flash_messages(unfollow_response)
 
     def test_user_unfollow_not_following(self, app):
         """Unfollow a user not currently following"""
@@ -488,7 +485,7 @@ class TestUser(object):
         user_one = factories.User()
         user_two = factories.User()
 
-        env = {"REMOTE_USER": user_one["name"].encode("ascii")}
+        env = _env(user_one)
         unfollow_url = url_for("user.unfollow", id=user_two["id"])
         unfollow_response = app.post(
             unfollow_url, extra_environ=env, status=302
@@ -505,13 +502,15 @@ class TestUser(object):
 
         user_one = factories.User()
 
-        env = {"REMOTE_USER": user_one["name"].encode("ascii")}
-        unfollow_url = url_for("user.unfollow", id="not-here")
+        env = _env(user_one)
+        unfollow_url = cached_url_for("user.unfollow", id="not-here")
         unfollow_response = app.post(
             unfollow_url, extra_environ=env, status=302
         )
-        unfollow_response = unfollow_response.follow(status=302)
-        assert "user/login" in unfollow_response.headers["location"]
+        assert urlparse(unfollow_response.location).path == url_for(
+            "user.read", id="not-here"
+        )
+        assert "Not found: User" in _flash_messages(unfollow_response)
 
     def test_user_follower_list(self, app):
         """Following users appear on followers list page."""
@@ -519,7 +518,7 @@ class TestUser(object):
         user_one = factories.Sysadmin()
         user_two = factories.User()
 
-        env = {"REMOTE_USER": user_one["name"].encode("ascii")}
+        env = _env(user_one)
         follow_url = url_for(
             controller="user", action="follow", id=user_two["id"]
         )
@@ -536,21 +535,25 @@ class TestUser(object):
     def test_user_page_anon_access(self, app):
         """Anon users can access the user list page"""
 
-        user_url = url_for("user.index")
+        user_url = cached_url_for("user.index")
         user_response = app.get(user_url, status=200)
         assert "<title>All Users - CKAN</title>" in user_response
 
     def test_user_page_lists_users(self, app):
         """/users/ lists registered users"""
         initial_user_count = model.User.count()
-        factories.User(fullname="User One")
-        factories.User(fullname="User Two")
-        factories.User(fullname="User Three")
+        factories.Users(
+            [
+                {"fullname": "User One"},
+                {"fullname": "User Two"},
+                {"fullname": "User Three"},
+            ]
+        )
 
-        user_url = url_for("user.index")
+        user_url = cached_url_for("user.index")
         user_response = app.get(user_url, status=200)
 
-        user_response_html = BeautifulSoup(user_response.body)
+        user_response_html = BeautifulSoup(user_response.body, "lxml")
         user_list = user_response_html.select("ul.user-list li")
         assert len(user_list) == 3 + initial_user_count
 
@@ -563,14 +566,18 @@ class TestUser(object):
         """/users/ doesn't list deleted users"""
         initial_user_count = model.User.count()
 
-        factories.User(fullname="User One", state="deleted")
-        factories.User(fullname="User Two")
-        factories.User(fullname="User Three")
+        factories.Users(
+            [
+                {"fullname": "User One", "state": "deleted"},
+                {"fullname": "User Two"},
+                {"fullname": "User Three"},
+            ]
+        )
 
-        user_url = url_for("user.index")
+        user_url = cached_url_for("user.index")
         user_response = app.get(user_url, status=200)
 
-        user_response_html = BeautifulSoup(user_response.body)
+        user_response_html = BeautifulSoup(user_response.body, "lxml")
         user_list = user_response_html.select("ul.user-list li")
         assert len(user_list) == 2 + initial_user_count
 
@@ -582,17 +589,21 @@ class TestUser(object):
     def test_user_page_anon_search(self, app):
         """Anon users can search for users by username."""
 
-        factories.User(fullname="User One", email="useroneemail@example.com")
-        factories.User(fullname="Person Two")
-        factories.User(fullname="Person Three")
+        factories.Users(
+            [
+                {"fullname": "User One", "email": "useroneemail@example.com"},
+                {"fullname": "Person Two"},
+                {"fullname": "Person Three"},
+            ]
+        )
 
-        user_url = url_for("user.index")
+        user_url = cached_url_for("user.index")
         user_response = app.get(user_url, status=200)
         search_form = user_response.forms["user-search-form"]
         search_form["q"] = "Person"
         search_response = webtest_submit(search_form, status=200)
 
-        search_response_html = BeautifulSoup(search_response.body)
+        search_response_html = BeautifulSoup(search_response.body, "lxml")
         user_list = search_response_html.select("ul.user-list li")
         assert len(user_list) == 2
 
@@ -604,17 +615,21 @@ class TestUser(object):
     def test_user_page_anon_search_not_by_email(self, app):
         """Anon users can not search for users by email."""
 
-        factories.User(fullname="User One", email="useroneemail@example.com")
-        factories.User(fullname="Person Two")
-        factories.User(fullname="Person Three")
+        factories.Users(
+            [
+                {"fullname": "User One", "email": "useroneemail@example.com"},
+                {"fullname": "Person Two"},
+                {"fullname": "Person Three"},
+            ]
+        )
 
-        user_url = url_for("user.index")
+        user_url = cached_url_for("user.index")
         user_response = app.get(user_url, status=200)
         search_form = user_response.forms["user-search-form"]
         search_form["q"] = "useroneemail@example.com"
         search_response = webtest_submit(search_form, status=200)
 
-        search_response_html = BeautifulSoup(search_response.body)
+        search_response_html = BeautifulSoup(search_response.body, "lxml")
         user_list = search_response_html.select("ul.user-list li")
         assert len(user_list) == 0
 
@@ -623,12 +638,16 @@ class TestUser(object):
 
         sysadmin = factories.Sysadmin()
 
-        factories.User(fullname="User One", email="useroneemail@example.com")
-        factories.User(fullname="Person Two")
-        factories.User(fullname="Person Three")
+        factories.Users(
+            [
+                {"fullname": "User One", "email": "useroneemail@example.com"},
+                {"fullname": "Person Two"},
+                {"fullname": "Person Three"},
+            ]
+        )
 
-        env = {"REMOTE_USER": sysadmin["name"].encode("ascii")}
-        user_url = url_for("user.index")
+        env = _env(sysadmin)
+        user_url = cached_url_for("user.index")
         user_response = app.get(user_url, status=200, extra_environ=env)
         search_form = user_response.forms["user-search-form"]
         search_form["q"] = "useroneemail@example.com"
@@ -636,7 +655,7 @@ class TestUser(object):
             search_form, status=200, extra_environ=env
         )
 
-        search_response_html = BeautifulSoup(search_response.body)
+        search_response_html = BeautifulSoup(search_response.body, "lxml")
         user_list = search_response_html.select("ul.user-list li")
         assert len(user_list) == 1
         assert user_list[0].text.strip() == "User One"
@@ -679,9 +698,10 @@ class TestUser(object):
         )
         assert "updated their profile" in response
 
-    def test_create_dataset(self, app):
+    @pytest.mark.usefixtures("no_solr")
+    def test_create_dataset(self, app, activity_user):
 
-        user = factories.User()
+        user = activity_user
         _clear_activities()
         dataset = factories.Dataset(user=user)
 
@@ -696,10 +716,11 @@ class TestUser(object):
             in response
         )
 
-    def test_change_dataset(self, app):
+    @pytest.mark.usefixtures("no_solr")
+    def test_change_dataset(self, app, activity_user, activity_dataset):
 
-        user = factories.User()
-        dataset = factories.Dataset(user=user)
+        user = activity_user
+        dataset = dict(activity_dataset)
         _clear_activities()
         dataset["title"] = "Dataset with changed title"
         helpers.call_action(
@@ -719,17 +740,18 @@ class TestUser(object):
             in response
         )
 
-    def test_delete_dataset(self, app):
+    @pytest.mark.usefixtures("no_solr")
+    def test_delete_dataset(self, app, activity_user, activity_dataset):
 
-        user = factories.User()
-        dataset = factories.Dataset(user=user)
+        user = activity_user
+        dataset = dict(activity_dataset)
         _clear_activities()
         helpers.call_action(
             "package_delete", context={"user": user["name"]}, **dataset
         )
 
         url = url_for("user.activity", id=user["id"])
-        env = {"REMOTE_USER": user["name"].encode("ascii")}
+        env = _env(user)
         response = app.get(url, extra_environ=env)
         assert (
             '<a href="/user/{}">Mr. Test User'.format(user["name"]) in response
@@ -740,9 +762,9 @@ class TestUser(object):
             in response
         )
 
-    def test_create_group(self, app):
+    def test_create_group(self, app, activity_user):
 
-        user = factories.User()
+        user = activity_user
         group = factories.Group(user=user)
 
         url = url_for("user.activity", id=user["id"])
@@ -753,10 +775,10 @@ class TestUser(object):
         assert "created the group" in response
         assert '<a href="/group/{}">Test Group'.format(group["id"]) in response
 
-    def test_change_group(self, app):
+    def test_change_group(self, app, activity_user, activity_group):
 
-        user = factories.User()
-        group = factories.Group(user=user)
+        user = activity_user
+        group = dict(activity_group)
         _clear_activities()
         group["title"] = "Group with changed title"
         helpers.call_action(
@@ -774,10 +796,12 @@ class TestUser(object):
             in response
         )
 
-    def test_delete_group_using_group_delete(self, app):
+    def test_delete_group_using_group_delete(
+        self, app, activity_user, activity_group
+    ):
 
-        user = factories.User()
-        group = factories.Group(user=user)
+        user = activity_user
+        group = dict(activity_group)
         _clear_activities()
         helpers.call_action(
             "group_delete", context={"user": user["name"]}, **group
@@ -791,10 +815,12 @@ class TestUser(object):
         assert "deleted the group" in response
         assert '<a href="/group/{}">Test Group'.format(group["id"]) in response
 
-    def test_delete_group_by_updating_state(self, app):
+    def test_delete_group_by_updating_state(
+        self, app, activity_user, activity_group
+    ):
 
-        user = factories.User()
-        group = factories.Group(user=user)
+        user = activity_user
+        group = dict(activity_group)
         _clear_activities()
         group["state"] = "deleted"
         helpers.call_action(
@@ -802,7 +828,7 @@ class TestUser(object):
         )
 
         url = url_for("group.activity", id=group["id"])
-        env = {"REMOTE_USER": user["name"].encode("ascii")}
+        env = _env(user)
         response = app.get(url, extra_environ=env)
         assert (
             '<a href="/user/{}">Mr. Test User'.format(user["name"]) in response
@@ -812,91 +838,96 @@ class TestUser(object):
             '<a href="/group/{}">Test Group'.format(group["name"]) in response
         )
 
-    @mock.patch("ckan.lib.mailer.send_reset_link")
+
+@pytest.mark.usefixtures("fast_password_hashing", "rollback_db")
+class TestRequestReset(object):
+    @pytest.fixture(scope="class")
+    def shared_app(self, clean_db_once):
+        # Building the app is slow and none of these tests need a
+        # different config, so build it once for the whole class. This
+        # bypasses the ``ckan_config`` fixture, so restore the config
+        # changes made while building it the same way.
+        original_config = config.copy()
+        yield helpers._get_test_app()
+        config.clear()
+        config.update(original_config)
+
+    @pytest.fixture
+    def app(self, shared_app):
+        shared_app.reset()
+        return shared_app
+
     def test_request_reset_by_email(self, send_reset_link, app):
+        offset = cached_url_for("user.request_reset")
         user = factories.User()
 
-        offset = url_for("user.request_reset")
         response = app.post(
             offset, params=dict(user=user["email"]), status=302
-        ).follow()
+        )
 
-        assert "A reset link has been emailed to you" in response
+        assert urlparse(response.location).path == cached_url_for("home.index")
+        assert RESET_EMAILED_MSG in _flash_messages(response)
         assert send_reset_link.call_args[0][0].id == user["id"]
 
-    @mock.patch("ckan.lib.mailer.send_reset_link")
     def test_request_reset_by_name(self, send_reset_link, app):
+        offset = cached_url_for("user.request_reset")
         user = factories.User()
 
-        offset = url_for("user.request_reset")
         response = app.post(
             offset, params=dict(user=user["name"]), status=302
-        ).follow()
+        )
 
-        assert "A reset link has been emailed to you" in response
+        assert urlparse(response.location).path == cached_url_for("home.index")
+        assert RESET_EMAILED_MSG in _flash_messages(response)
         assert send_reset_link.call_args[0][0].id == user["id"]
 
-    @mock.patch("ckan.lib.mailer.send_reset_link")
     def test_request_reset_when_duplicate_emails(self, send_reset_link, app):
+        offset = cached_url_for("user.request_reset")
         user_a = factories.User(email="me@example.com")
         user_b = factories.User(email="me@example.com")
 
-        offset = url_for("user.request_reset")
         response = app.post(
             offset, params=dict(user="me@example.com"), status=302
         ).follow()
+        body = response.text
 
-        assert "A reset link has been emailed to you" in response
+        assert RESET_EMAILED_MSG in body
         emailed_users = [
             call[0][0].name for call in send_reset_link.call_args_list
         ]
         assert emailed_users == [user_a["name"], user_b["name"]]
 
-    def test_request_reset_without_param(self, app):
-
-        offset = url_for("user.request_reset")
-        response = app.post(offset).follow()
-
-        assert "Email is required" in response
-
-    @mock.patch("ckan.lib.mailer.send_reset_link")
-    def test_request_reset_for_unknown_username(self, send_reset_link, app):
-
-        offset = url_for("user.request_reset")
-        response = app.post(
-            offset, params=dict(user="unknown"), status=302
-        ).follow()
-
-        # doesn't reveal account does or doesn't exist
-        assert "A reset link has been emailed to you" in response
-        send_reset_link.assert_not_called()
-
-    @mock.patch("ckan.lib.mailer.send_reset_link")
-    def test_request_reset_for_unknown_email(self, send_reset_link, app):
-
-        offset = url_for("user.request_reset")
-        response = app.post(
-            offset, params=dict(user="unknown@example.com"), status=302
-        ).follow()
+    @pytest.mark.parametrize(
+        "params,route,expected",
+        [
+            # back to the form
+            ({}, "user.request_reset", "Email is required"),
+            # doesn't reveal account does or doesn't exist
+            ({"user": "unknown"}, "home.index", RESET_EMAILED_MSG),
+            ({"user": "unknown@example.com"}, "home.index", RESET_EMAILED_MSG),
+        ],
+    )
+    def test_request_reset_unknown_or_missing_user(
+        self, send_reset_link, app, params, route, expected
+    ):
+        offset = cached_url_for("user.request_reset")
+        response = app.post(offset, params=params)
 
-        # doesn't reveal account does or doesn't exist
-        assert "A reset link has been emailed to you" in response
+        assert response.status_int == 302
+        assert urlparse(response.location).path == cached_url_for(route)
+        assert expected in _flash_messages(response)
         send_reset_link.assert_not_called()
 
-    @mock.patch("ckan.lib.mailer.send_reset_link")
     def test_request_reset_but_mailer_not_configured(
-        self, send_reset_link, app
+        self, send_reset_link, app, shared_user
     ):
-        user = factories.User()
+        offset = cached_url_for("user.request_reset")
+        user = shared_user
 
-        offset = url_for("user.request_reset")
-        # This is the exception when the mailer is not configured:
-        send_reset_link.side_effect = MailerException(
-            'SMTP server could not be connected to: "localhost" '
-            "[Errno 111] Connection refused"
-        )
+        send_reset_link.side_effect = _SMTP_REFUSED
         response = app.post(
             offset, params=dict(user=user["name"]), status=302
-        ).follow()
+        )
 
-        assert "Error sending the email" in response
+        assert "Error sending the email" in _flash_messages(response)
+        assert send_reset_link.call_args[0][0].id == user["id"]
@@ -135,6 +135,48 @@ class User(factory.Factory):
         return user_dict
 
 
+def Users(specs):
+    """Create several users at once with a single bulk INSERT.
+
+    Each item of ``specs`` is a dict of attributes that overrides the
+    :py:class:`User` factory defaults, e.g.::
+
+        users = factories.Users([
+            {"fullname": "User One", "state": "deleted"},
+            {"fullname": "User Two"},
+        ])
+
+    Unlike :py:class:`User`, this doesn't call ``user_create``, so the
+    data is not validated and no activities are created. Use it when a
+    test only needs some users to exist, e.g. to be listed on a page.
+
+    :returns: a list of dicts with the attributes of the created users
+        (without the password)
+    :rtype: list of dicts
+
+    """
+    password_hashes = {}
+    rows = []
+    for spec in specs:
+        row = User.attributes(extra=spec)
+        password = row.pop("password")
+        if password not in password_hashes:
+            password_hashes[password] = ckan.model.User(
+                password=password
+            ).password
+        row["_password"] = password_hashes[password]
+        row.setdefault("id", ckan.model.types.make_uuid())
+        rows.append(row)
+
+    ckan.model.Session.bulk_insert_mappings(ckan.model.User, rows)
+    ckan.model.Session.commit()
+
+    return [
+        dict((key, value) for key, value in row.items() if key != "_password")
+        for row in rows
+    ]
+
+
 class Resource(factory.Factory):
     """A factory class for creating CKAN resources."""
 
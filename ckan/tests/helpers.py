@@ -33,6 +33,7 @@ import rq
 
 from ckan.common import config
 import ckan.lib.jobs as jobs
+from ckan.lib.helpers import url_for
 from ckan.lib.redis import connect_to_redis
 import ckan.lib.search as search
 import ckan.config.middleware
@@ -76,6 +77,36 @@ def reset_db():
     model.repo.rebuild_db()
 
 
+_url_for_cache = {}
+
+
+def cached_url_for(*args, **kwargs):
+    """Memoized version of :py:func:`ckan.lib.helpers.url_for`.
+
+    Building a URL goes through the Flask (and possibly Pylons) routing
+    every time, even though the result for a given endpoint and set of
+    parameters doesn't change during a test run. Use this in tests that
+    build the same URLs over and over again::
+
+        url = helpers.cached_url_for('user.index')
+
+    The ``ckan.root_path`` and ``ckan.site_url`` config options are part
+    of the cache key, but nothing else is, so don't use it for URLs that
+    depend on the current request (e.g. its locale) or on routes added by
+    plugins loaded during the test.
+
+    """
+    key = (
+        args,
+        frozenset(kwargs.items()),
+        config.get("ckan.root_path"),
+        config.get("ckan.site_url"),
+    )
+    if key not in _url_for_cache:
+        _url_for_cache[key] = url_for(*args, **kwargs)
+    return _url_for_cache[key]
+
+
 def call_action(action_name, context=None, **kwargs):
     """Call the named ``ckan.logic.action`` function and return the result.
 
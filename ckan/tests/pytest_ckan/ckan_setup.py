@@ -1,5 +1,12 @@
 # -*- coding: utf-8 -*-
 
+import copy
+import os
+
+import sqlalchemy
+from sqlalchemy.engine.url import make_url
+
+import ckan.model as model
 from ckan.config.middleware import make_app
 from ckan.cli import load_config
 
@@ -18,6 +25,17 @@ def pytest_sessionstart(session):
     """Initialize CKAN environment.
     """
     conf = load_config(session.config.option.ckan_ini)
+    # Every pytest-xdist worker gets a database of its own, so tests
+    # running in parallel don't clean each other's data.
+    worker = os.environ.get(u"PYTEST_XDIST_WORKER")
+    created = False
+    if worker:
+        url = _worker_database_url(_database_url(conf), worker)
+        created = _create_database(url)
+        conf.local_conf[u"sqlalchemy.url"] = url
+        # The environment variable wins over the config file when the
+        # app is created (see ckan.config.environment.update_config)
+        os.environ[u"CKAN_SQLALCHEMY_URL"] = url
     # Set this internal test request context with the configured environment so
     # it can be used when calling url_for from the cli.
     global _tests_test_request_context
@@ -26,6 +44,54 @@ def pytest_sessionstart(session):
     flask_app = app.apps['flask_app']._wsgi_app
     _tests_test_request_context = flask_app.test_request_context()
 
+    if created:
+        # Not every test module cleans the database before using it
+        model.repo.init_db()
+
+
+def _database_url(conf):
+    """Return the database URL the app would end up using, taking the
+    environment variables into account.
+    """
+    return (
+        os.environ.get(u"CKAN_SQLALCHEMY_URL")
+        or os.environ.get(u"CKAN_DB")
+        or conf.local_conf[u"sqlalchemy.url"]
+    )
+
+
+def _worker_database_url(url, worker):
+    """Return the URL of the database for the given xdist worker.
+
+    The database is named after the original one plus the worker id,
+    e.g. ``ckan_test_gw0``.
+    """
+    url = make_url(url)
+    url.database = u"{}_{}".format(url.database, worker)
+    return str(url)
+
+
+def _create_database(url):
+    """Create the database if it doesn't exist yet.
+
+    Returns True if the database was created.
+    """
+    url = make_url(url)
+    server_url = copy.copy(url)
+    server_url.database = u"postgres"
+    engine = sqlalchemy.create_engine(
+        server_url, isolation_level=u"AUTOCOMMIT"
+    )
+    with engine.connect() as connection:
+        query = sqlalchemy.text(
+            u"SELECT 1 FROM pg_database WHERE datname = :name"
+        )
+        exists = connection.execute(query, name=url.database).scalar()
+        if not exists:
+            connection.execute(u'CREATE DATABASE "{}"'.format(url.database))
+    engine.dispose()
+    return not exists
+
 
 def pytest_runtest_setup(item):
     """Automatically apply `ckan_config` fixture if test has `ckan_config`
@@ -28,10 +28,17 @@ Deeper expanation can be found in `official documentation
 
 """
 
+import contextlib
+
+import mock
 import pytest
+from passlib.hash import pbkdf2_sha512
+from sqlalchemy import event
+
 import ckan.tests.helpers as test_helpers
 import ckan.plugins
 import ckan.lib.search as search
+import ckan.model as model
 from ckan.common import config
 
 
@@ -141,6 +148,127 @@ def clean_db(reset_db):
     reset_db()
 
 
+@pytest.fixture(scope=u"module")
+def clean_db_once(reset_db):
+    """Resets the database only once for the whole test module.
+
+    It's used by ``rollback_db``, which takes care of isolating
+    individual tests from each other.
+    """
+    reset_db()
+
+
+@pytest.fixture
+def rollback_db(clean_db_once):
+    """Runs the test inside a transaction that is rolled back at the end.
+
+    The database is cleaned once per module and every test then works
+    inside a SAVEPOINT on a shared connection, so changes made by one
+    test are discarded without deleting the data of every table before
+    the next one. It can be used the same way as ``clean_db``::
+
+        @pytest.mark.usefixtures("rollback_db")
+        class TestExample(object):
+
+            def test_example(self):
+
+    Commits and rollbacks issued by CKAN itself only affect the
+    SAVEPOINT, which is restarted right after. Data created by fixtures
+    with a scope wider than ``function`` is not rolled back.
+
+    """
+    with _rollback_db():
+        yield
+
+
+@contextlib.contextmanager
+def _rollback_db():
+    """Run the block inside a transaction that is rolled back at the end.
+
+    This is the body of the ``rollback_db`` fixture, kept apart so it can
+    be tested without depending on the order of the tests.
+    """
+    connection = model.meta.engine.connect()
+    transaction = connection.begin()
+    model.Session.remove()
+    model.Session.configure(bind=connection)
+
+    def begin_savepoint(session, trans, conn):
+        # New sessions (CKAN removes the session after every request)
+        # start with a SAVEPOINT as well.
+        if not trans.nested:
+            session.begin_nested()
+            session.connection()
+
+    def restart_savepoint(session, trans):
+        if trans.nested and not trans._parent.nested:
+            session.expire_all()
+            session.begin_nested()
+
+    init_model = model.init_model
+
+    def init_model_on_connection(engine):
+        # Building an app (e.g. the ``app`` fixture) binds the session to
+        # a new engine, so bind it back to the connection
+        init_model(engine)
+        model.Session.remove()
+        model.Session.configure(bind=connection)
+
+    event.listen(model.Session, u"after_begin", begin_savepoint)
+    event.listen(model.Session, u"after_transaction_end", restart_savepoint)
+    patch = mock.patch.object(model, u"init_model", init_model_on_connection)
+    patch.start()
+    try:
+        yield
+    finally:
+        patch.stop()
+        event.remove(
+            model.Session, u"after_transaction_end", restart_savepoint
+        )
+        event.remove(model.Session, u"after_begin", begin_savepoint)
+
+        model.Session.remove()
+        transaction.rollback()
+        connection.close()
+        model.Session.configure(bind=model.meta.engine)
+
+
+@pytest.fixture(scope=u"module")
+def fast_password_hashing():
+    """Hash user passwords with a single PBKDF2 round.
+
+    Creating a user with the default number of rounds takes a noticeable
+    amount of time, which adds up in modules that create lots of users::
+
+        @pytest.mark.usefixtures("fast_password_hashing")
+        class TestExample(object):
+
+            def test_example(self):
+
+    The hash of each password is also computed only once, so users
+    created with the same password get the same hash (and salt).
+
+    Don't use it in tests that check the hashing itself: with a single
+    round by default, stored hashes are never upgraded on login.
+
+    """
+    hashes = {}
+
+    class FastPbkdf2Sha512(pbkdf2_sha512):
+        default_rounds = 1
+
+        @classmethod
+        def encrypt(cls, secret, **kwargs):
+            if kwargs:
+                return super(FastPbkdf2Sha512, cls).encrypt(secret, **kwargs)
+            if secret not in hashes:
+                hashes[secret] = super(FastPbkdf2Sha512, cls).encrypt(secret)
+            return hashes[secret]
+
+    with mock.patch(u"ckan.model.user.pbkdf2_sha512", FastPbkdf2Sha512):
+        yield
+
+
 @pytest.fixture
 def clean_index(reset_index):
     """Clear search index before starting the test.
@@ -148,6 +276,31 @@ def clean_index(reset_index):
     reset_index()
 
 
+@pytest.fixture
+def no_solr(monkeypatch):
+    """Don't send datasets to the search index during the test.
+
+    Useful for tests that create or update datasets but only check
+    things that come from the database (activity streams, etc.), so
+    they don't have to wait for Solr on every change::
+
+        @pytest.mark.usefixtures("no_solr")
+        def test_example():
+
+    Anything that searches for datasets (``package_search``, the dataset
+    list pages, dashboards) won't find the datasets created by the test.
+
+    """
+    monkeypatch.setattr(
+        u"ckan.lib.search.index.PackageSearchIndex.update_dict",
+        lambda *args, **kwargs: None,
+    )
+    monkeypatch.setattr(
+        u"ckan.lib.search.index.PackageSearchIndex.remove_dict",
+        lambda *args, **kwargs: None,
+    )
+
+
 @pytest.fixture
 def with_plugins(ckan_config):
     """Load all plugins specified by the ``ckan.plugins`` config option
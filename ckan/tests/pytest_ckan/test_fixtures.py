@@ -2,9 +2,13 @@
 
 import pytest
 
+import ckan.model as model
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as tk
+import ckan.tests.factories as factories
+import ckan.tests.helpers as helpers
 from ckan.common import config
+from ckan.tests.pytest_ckan.fixtures import _rollback_db
 
 
 def test_ckan_config_fixture(ckan_config):
@@ -60,3 +64,40 @@ class TestMethodLevelConfig:
 
     def test_ckan_config_mark_second(self, ckan_config):
         assert ckan_config[u"some.new.config"] == u"exists"
+
+
+@pytest.mark.usefixtures(u"clean_db")
+def test_rollback_db_discards_changes():
+    with _rollback_db():
+        factories.User(name=u"rollback_db_user")
+        assert model.User.by_name(u"rollback_db_user")
+
+    assert model.User.by_name(u"rollback_db_user") is None
+
+
+@pytest.mark.usefixtures(u"clean_db")
+def test_rollback_db_keeps_changes_across_requests(make_app):
+    with _rollback_db():
+        # Building the app inside the block must not lose the connection
+        app = make_app()
+        factories.User(name=u"rollback_db_user")
+
+        app.get(u"/user/rollback_db_user", status=200)
+        assert model.User.by_name(u"rollback_db_user")
+        app.get(u"/user/rollback_db_user", status=200)
+
+    assert model.User.by_name(u"rollback_db_user") is None
+
+
+@pytest.mark.usefixtures(u"fast_password_hashing")
+def test_fast_password_hashing_reuses_hashes():
+    user_a = model.User(password=u"RandomPassword123")
+    user_b = model.User(password=u"RandomPassword123")
+    assert user_a.password == user_b.password
+    assert user_b.validate_password(u"RandomPassword123")
+
+
+@pytest.mark.usefixtures(u"clean_db", u"clean_index", u"no_solr")
+def test_no_solr_skips_indexing():
+    factories.Dataset()
+    assert helpers.call_action(u"package_search")[u"count"] == 0
@@ -2,6 +2,7 @@
 
 import pytest
 
+import ckan.model as model
 import ckan.tests.factories as factories
 
 
@@ -45,3 +46,12 @@ def test_resource_view_factory():
 def test_dataset_factory_allows_creation_by_anonymous_user():
     dataset = factories.Dataset(user=None)
     assert dataset[u"creator_user_id"] is None
+
+
+def test_users_factory_creates_all_users():
+    users = factories.Users(
+        [{u"fullname": u"User One"}, {u"fullname": u"User Two"}]
+    )
+    assert users[0][u"id"] != users[1][u"id"]
+    for user in users:
+        assert model.User.get(user[u"id"]).fullname == user[u"fullname"]
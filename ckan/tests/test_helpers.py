@@ -0,0 +1,27 @@
+# encoding: utf-8
+
+import mock
+
+import ckan.tests.helpers as helpers
+
+
+def test_cached_url_for_builds_the_url_once():
+    with mock.patch.object(
+        helpers, u"url_for", wraps=helpers.url_for
+    ) as url_for:
+        url = helpers.cached_url_for(u"user.index", q=u"cached_url_for")
+        cached = helpers.cached_url_for(u"user.index", q=u"cached_url_for")
+
+    assert cached == url
+    assert url_for.call_count == 1
+    assert url == helpers.url_for(u"user.index", q=u"cached_url_for")
+
+
+def test_cached_url_for_takes_root_path_into_account(ckan_config, monkeypatch):
+    url = helpers.cached_url_for(u"user.index")
+
+    monkeypatch.setitem(ckan_config, u"ckan.root_path", u"/my/prefix")
+    prefixed_url = helpers.cached_url_for(u"user.index")
+
+    assert prefixed_url != url
+    assert prefixed_url == helpers.url_for(u"user.index")